@@ -20,29 +20,50 @@ import os
 import re
 import shutil
 import subprocess
+import threading
 
+# The "Type (Bundle): ..." entry of `diskutil info`, naming the filesystem.
+_DISKUTIL_FS_TYPE_RE = re.compile(r'(?:Type \(Bundle\):) +([^ ]+)')
 
-def _APFSCheck(volume_path):
-  """Reports if the given path belongs to an APFS volume.
 
-  Args:
-    volume_path: Absolute path to the volume we want to test.
+class _APFSVolumeCheck(object):
+  """Reports if the given path belongs to an APFS volume.
 
-  Returns:
-    True if the volume has been formatted as APFS.
-    False if not.
+  diskutil is started as soon as the check is created, but its output is only
+  waited on the first time the result is needed, so the check runs alongside
+  whatever the caller does in the meantime.
   """
-  output = subprocess.check_output(['diskutil',
-                                    'info',
-                                    volume_path])
-  # Match the output's "Type (Bundle): ..." entry to determine if apfs.
-  target_fs = re.search(r'(?:Type \(Bundle\):) +([^ ]+)', output)
-  if not target_fs:
-    return False
-  filesystem = target_fs.group(1)
-  if 'apfs' not in filesystem:
-    return False
-  return True
+
+  def __init__(self, volume_path):
+    """Starts checking the volume at the given absolute path."""
+    self._lock = threading.Lock()
+    self._result = None
+    try:
+      self._process = subprocess.Popen(['diskutil', 'info', volume_path],
+                                       stdout=subprocess.PIPE)
+    except OSError:
+      self._process = None
+      self._result = False
+
+  def Result(self):
+    """Returns True if the volume has been formatted as APFS, False if not."""
+    with self._lock:
+      if self._result is None:
+        output, _ = self._process.communicate()
+        self._result = (self._process.returncode == 0 and
+                        self._IsAPFSOutput(output))
+      return self._result
+
+  @staticmethod
+  def _IsAPFSOutput(output):
+    # Match the output's "Type (Bundle): ..." entry to determine if apfs.
+    target_fs = _DISKUTIL_FS_TYPE_RE.search(output)
+    if not target_fs:
+      return False
+    filesystem = target_fs.group(1)
+    if 'apfs' not in filesystem:
+      return False
+    return True
 
 
 def _IsOnDevice(path, st_dev):
@@ -68,8 +89,8 @@ def _IsOnDevice(path, st_dev):
         return _IsOnDevice(dirname, st_dev)
   return False
 
-# At launch, determine if the root filesystem is APFS.
-IS_ROOT_APFS = _APFSCheck('/')
+# At launch, start determining if the root filesystem is APFS.
+_ROOT_APFS_CHECK = _APFSVolumeCheck('/')
 
 # At launch, determine the root filesystem device ID.
 ROOT_ST_DEV = os.stat('/').st_dev
@@ -88,8 +109,8 @@ def CopyOnWrite(source, dest, tree=False):
   #
   # Identical to shutil's copy2 method, used by shutil's move and copytree.
   cmd = ['cp']
-  if IS_ROOT_APFS and _IsOnDevice(source, ROOT_ST_DEV) and _IsOnDevice(
-      dest, ROOT_ST_DEV):
+  if (_ROOT_APFS_CHECK.Result() and _IsOnDevice(source, ROOT_ST_DEV) and
+      _IsOnDevice(dest, ROOT_ST_DEV)):
     # Copy on write (clone) is possible if both source and destination reside in
     # the same APFS volume. For simplicity, and since checking FS type can be
     # expensive, allow CoW only for the root volume.
@@ -17,24 +17,30 @@
 """Bridge between Xcode and Bazel for the "build" action."""
 
 import atexit
+import contextlib
 import errno
 import fcntl
 import hashlib
 import inspect
 import io
 import json
+import mmap
+from multiprocessing.pool import ThreadPool
 import os
 import pipes
 import plistlib
 import re
 import shutil
 import signal
+import struct
 import subprocess
 import sys
 import textwrap
 import threading
 import time
+import traceback
 import zipfile
+import zlib
 
 from apfs_clone_copy import CopyOnWrite
 import bazel_build_events
@@ -42,9 +48,18 @@ import bazel_build_settings
 import bazel_options
 from bootstrap_lldbinit import BootstrapLLDBInit
 from bootstrap_lldbinit import TULSI_LLDBINIT_FILE
+from bootstrap_lldbinit import XCODE_LLDBINIT_FILES
+from install_genfiles import Installer
 import tulsi_logging
 from update_symbol_cache import UpdateSymbolCache
 
+try:
+  # RE2 matches in linear time without backtracking. The patterns used to patch
+  # Bazel's output are supported by both engines, so prefer RE2 if available.
+  import re2 as output_re
+except ImportError:
+  output_re = re
+
 
 # List of frameworks that Xcode injects into test host targets that should be
 # re-signed when running the tests on devices.
@@ -56,6 +71,48 @@ XCODE_INJECTED_FRAMEWORKS = [
     'XCTest.framework',
 ]
 
+# Bazel diagnostic lines, used to make Bazel output more Xcode friendly. The
+# first alternative matches diagnostics with a file location, the second one
+# any other diagnostic.
+_BAZEL_DIAGNOSTIC_RE = output_re.compile(
+    r'(INFO|DEBUG|WARNING|ERROR|FAILED): '
+    r'(?:([^:]+:\d+:(?:\d+:)?)\s+(.+)|(.*))')
+
+# Maps Bazel diagnostic labels to Xcode labels for build output.
+_BAZEL_TO_XCODE_LABELS = {
+    'INFO': 'note',
+    'DEBUG': 'note',
+    'WARNING': 'warning',
+    'ERROR': 'error',
+    'FAILED': 'error',
+}
+
+# The prefixes every line matched by _BAZEL_DIAGNOSTIC_RE starts with. Most
+# output lines are not Bazel diagnostics and are ruled out with these without
+# running the regex.
+_BAZEL_DIAGNOSTIC_PREFIXES = tuple(
+    label + ': ' for label in _BAZEL_TO_XCODE_LABELS)
+
+# Match (likely) filename:line_number: lines.
+_XCODE_PARSABLE_LINE_RE = output_re.compile(r'([^/][^:]+):\d+:')
+
+# Verbosity flags given to the script, e.g. -vv.
+_VERBOSE_FLAG_RE = re.compile(r'-(v+)$')
+
+# A binary slice reported by `dwarfdump --uuid`, e.g.
+# "UUID: D4DE5AA2-79EE-36FE-980C-755AED318308 (x86_64) /path/to/binary".
+_DWARFDUMP_UUID_RE = re.compile(r'^(?:UUID: )([^ \n]+) \(([^)\n]+)',
+                                re.MULTILINE)
+
+# Buffer size used when decompressing archive members during extraction.
+_EXTRACTION_COPY_SIZE = 1024 * 1024
+
+# The fixed size part of a zip archive member's local file header: signature,
+# versions, flags, compression, time, date, CRC-32, sizes and the lengths of
+# the file name and extra field that follow it.
+_ZIP_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
 _logger = None
 
 
@@ -108,16 +165,153 @@ def _InterruptHandler(signum, frame):
 
 def _FindDefaultLldbInit():
   """Returns the path to the primary lldbinit file that Xcode would load or None when no file exists."""
-  for lldbinit_shortpath in ['~/.lldbinit-Xcode', '~/.lldbinit']:
-    lldbinit_path = os.path.expanduser(lldbinit_shortpath)
+  for lldbinit_path in XCODE_LLDBINIT_FILES:
     if os.path.isfile(lldbinit_path):
       return lldbinit_path
 
   return None
 
 
+def _ParallelMap(func, items, max_workers=8):
+  """Returns [func(item) for item in items], computed on a pool of threads.
+
+  Only suited for functions that spend most of their time in I/O or waiting
+  on subprocesses, as the GIL serializes everything else.
+
+  Args:
+    func: Function to apply to every item. Must be thread-safe.
+    items: Iterable of items to process.
+    max_workers: Upper bound on the number of threads used.
+
+  Returns:
+    A list of the results of func, in the same order as items.
+  """
+  items = list(items)
+  if len(items) < 2:
+    return [func(item) for item in items]
+  pool = ThreadPool(min(max_workers, len(items)))
+  try:
+    return pool.map(func, items)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _MapFile(path):
+  """Returns a read-only memory map of the file at the given path."""
+  with open(path, 'rb') as f:
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _RawMemberData(mapped, info):
+  """Returns a buffer over the raw data of an archive member.
+
+  This lets stored and deflated members be written out straight from the
+  memory map, without going through a ZipExtFile. Unlike ZipExtFile, the data's
+  CRC is left to the caller to verify.
+
+  Args:
+    mapped: Memory map of the archive.
+    info: ZipInfo of the member.
+
+  Returns:
+    A buffer over the member's data as it is stored in the archive, or None if
+    the member has to be read through zipfile (it uses another compression
+    method or is encrypted, or its local header is malformed).
+  """
+  if (info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or
+      info.flag_bits & 0x1):
+    return None
+  header_end = info.header_offset + _ZIP_LOCAL_HEADER.size
+  header = mapped[info.header_offset:header_end]
+  if len(header) != _ZIP_LOCAL_HEADER.size:
+    return None
+  fields = _ZIP_LOCAL_HEADER.unpack(header)
+  signature, filename_length, extra_field_length = (fields[0], fields[-2],
+                                                    fields[-1])
+  if signature != _ZIP_LOCAL_HEADER_SIGNATURE:
+    return None
+  # The local header's extra field may differ from the central directory's.
+  data_start = header_end + filename_length + extra_field_length
+  if data_start + info.compress_size > len(mapped):
+    return None
+  return buffer(mapped, data_start, info.compress_size)
+
+
+def _WriteAll(fd, data):
+  """Writes all of data to the file descriptor fd."""
+  while data:
+    written = os.write(fd, data)
+    data = buffer(data, written)
+
+
+def _InflateTo(data, fd):
+  """Writes the decompressed contents of raw deflate data to fd.
+
+  At most _EXTRACTION_COPY_SIZE bytes of output are held in memory at a time,
+  however well the data compresses.
+
+  Args:
+    data: Raw deflate data, without any zlib header.
+    fd: File descriptor to write the decompressed data to.
+
+  Returns:
+    The CRC-32 of the decompressed data.
+  """
+  decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+  crc = 0
+  for offset in xrange(0, len(data), _EXTRACTION_COPY_SIZE):
+    chunk = buffer(data, offset, _EXTRACTION_COPY_SIZE)
+    while chunk:
+      output = decompressor.decompress(chunk, _EXTRACTION_COPY_SIZE)
+      crc = zlib.crc32(output, crc)
+      _WriteAll(fd, output)
+      chunk = decompressor.unconsumed_tail
+  output = decompressor.flush()
+  crc = zlib.crc32(output, crc)
+  _WriteAll(fd, output)
+  return crc
+
+
+class _MappedFile(object):
+  """Read-only file object over a memory map.
+
+  python2's mmap objects lack the read() without a size that zipfile relies on
+  to find an archive's central directory, so they can't be used directly.
+  """
+
+  def __init__(self, mapped):
+    self.mapped = mapped
+    self.position = 0
+
+  def read(self, size=-1):
+    start = self.position
+    end = len(self.mapped)
+    if size >= 0:
+      end = min(end, start + size)
+    self.position = max(start, end)
+    return self.mapped[start:end]
+
+  def seek(self, offset, whence=os.SEEK_SET):
+    if whence == os.SEEK_CUR:
+      offset += self.position
+    elif whence == os.SEEK_END:
+      offset += len(self.mapped)
+    self.position = offset
+
+  def tell(self):
+    return self.position
+
+
 class Timer(object):
-  """Simple profiler."""
+  """Simple profiler.
+
+  May be used as a context manager, which starts the timer on entry and logs
+  the elapsed time on exit unless the block raised:
+
+    with Timer('Doing things', 'doing_things'):
+      DoThings()
+  """
 
   def __init__(self, action_name, action_id):
     """Creates a new Timer object.
@@ -151,6 +345,14 @@ class Timer(object):
     else:
       _logger.log_action(self.action_name, self.action_id, seconds)
 
+  def __enter__(self):
+    return self.Start()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    # Only completed actions are logged, as with explicit Start/End calls.
+    if exc_type is None:
+      self.End()
+
 
 def _LockFileCreate():
   # This relies on this script running at the root of the bazel workspace.
@@ -174,15 +376,17 @@ def _LockFileAcquire(lock_path):
   lockfile = open(lock_path, 'w')
   # Register "fclose(...)" as early as possible, before acquiring lock.
   atexit.register(_LockFileExitCleanup, lockfile)
+  # Block until the lock is released, so that the kernel wakes this build as
+  # soon as the previous one is done rather than at its next poll. Signals
+  # interrupt the wait right away; their handlers have run by the time lockf
+  # fails with EINTR, so keep waiting if they didn't exit.
   while True:
     try:
-      fcntl.lockf(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
-      break
+      fcntl.lockf(lockfile, fcntl.LOCK_EX)
+      return
     except IOError as err:
-      if err.errno != errno.EAGAIN:
+      if err.errno != errno.EINTR:
         raise
-      else:
-        time.sleep(0.1)
 
 
 class CodesignBundleAttributes(object):
@@ -190,20 +394,19 @@ class CodesignBundleAttributes(object):
 
   # List of codesigning attributes that this script requires.
   _ATTRIBUTES = ['Authority', 'Identifier', 'TeamIdentifier']
+  _ATTRIBUTE_SET = frozenset(_ATTRIBUTES)
 
   def __init__(self, codesign_output):
     self.attributes = {}
 
-    pending_attributes = list(self._ATTRIBUTES)
+    # codesign reports attributes as Key=Value lines. Only the first value of
+    # an attribute is used, e.g. the leaf Authority of the certificate chain.
     for line in codesign_output.split('\n'):
-      if not pending_attributes:
-        break
-
-      for attribute in pending_attributes:
-        if line.startswith(attribute):
-          value = line[len(attribute) + 1:]
-          self.attributes[attribute] = value
-          pending_attributes.remove(attribute)
+      attribute, separator, value = line.partition('=')
+      if (separator and attribute in self._ATTRIBUTE_SET and
+          attribute not in self.attributes):
+        self.attributes[attribute] = value
+        if len(self.attributes) == len(self._ATTRIBUTE_SET):
           break
 
     for attribute in self._ATTRIBUTES:
@@ -214,18 +417,27 @@ class CodesignBundleAttributes(object):
   def Get(self, attribute):
     """Returns the value for the given attribute, or None if it wasn't found."""
     value = self.attributes.get(attribute)
-    if attribute not in self._ATTRIBUTES:
+    if attribute not in self._ATTRIBUTE_SET:
       _PrintXcodeError(
           'Attribute %s not declared to be parsed. ' % attribute +
           'Available attributes are %s.\n' % self._ATTRIBUTES)
     return value
 
 
+# Maps Xcode PLATFORM_NAME prefixes to the platform used in Bazel configs.
+_CONFIG_PLATFORMS = (
+    ('watch', 'watchos'),
+    ('iphone', 'ios'),
+    ('macos', 'macos'),
+    ('appletv', 'tvos'),
+)
+
+
 class _OptionsParser(object):
   """Handles parsing script options."""
 
   # List of all supported Xcode configurations.
-  KNOWN_CONFIGS = ['Debug', 'Release']
+  KNOWN_CONFIGS = frozenset(['Debug', 'Release'])
 
   def __init__(self, build_settings, sdk_version, platform_name, arch):
     self.targets = []
@@ -238,18 +450,13 @@ class _OptionsParser(object):
     self.sdk_version = sdk_version
     self.platform_name = platform_name
 
-    if self.platform_name.startswith('watch'):
-      config_platform = 'watchos'
-    elif self.platform_name.startswith('iphone'):
-      config_platform = 'ios'
-    elif self.platform_name.startswith('macos'):
-      config_platform = 'macos'
-    elif self.platform_name.startswith('appletv'):
-      config_platform = 'tvos'
+    for platform_prefix, config_platform in _CONFIG_PLATFORMS:
+      if self.platform_name.startswith(platform_prefix):
+        break
     else:
       self._WarnUnknownPlatform()
       config_platform = 'ios'
-    self.bazel_build_config = '{}_{}'.format(config_platform, arch)
+    self.bazel_build_config = config_platform + '_' + arch
     if self.bazel_build_config not in build_settings.platformConfigFlags:
       _PrintXcodeError('Unknown active compilation target of "{}". '
                        'Please report a Tulsi bug.'
@@ -260,6 +467,10 @@ class _OptionsParser(object):
     self.bazel_bin_path = 'bazel-bin'
     self.bazel_executable = None
 
+    # The active Xcode doesn't change during a build, so the flag (which reads
+    # Xcode's version.plist) is computed once rather than for every config.
+    self.xcode_version_flag = self._ComputeXcodeVersionFlag()
+
   @staticmethod
   def _UsageMessage():
     """Returns a usage message string."""
@@ -303,13 +514,10 @@ class _OptionsParser(object):
   def GetBazelOptions(self, config):
     """Returns the full set of build options for the given config."""
     bazel, start_up, build = self.GetBaseFlagsForTargets(config)
-    all_build = []
-    all_build.extend(self.common_build_options)
-    all_build.extend(build)
+    all_build = self.common_build_options + build
 
-    xcode_version_flag = self._ComputeXcodeVersionFlag()
-    if xcode_version_flag:
-      all_build.append('--xcode_version=%s' % xcode_version_flag)
+    if self.xcode_version_flag:
+      all_build.append('--xcode_version=%s' % self.xcode_version_flag)
 
     return bazel, start_up, all_build
 
@@ -320,23 +528,22 @@ class _OptionsParser(object):
   def _ParseVariableOptions(self, args):
     """Parses flag-based args, returning (message, exit_code)."""
 
-    verbose_re = re.compile('-(v+)$')
-
-    while args:
-      arg = args[0]
-      args = args[1:]
+    i = 0
+    while i < len(args):
+      arg = args[i]
+      i += 1
 
       if arg == '--bazel_bin_path':
-        if not args:
+        if i == len(args):
           return ('Missing required parameter for %s' % arg, 2)
-        self.bazel_bin_path = args[0]
-        args = args[1:]
+        self.bazel_bin_path = args[i]
+        i += 1
 
       elif arg == '--verbose':
         self.verbose += 1
 
       else:
-        match = verbose_re.match(arg)
+        match = _VERBOSE_FLAG_RE.match(arg)
         if match:
           self.verbose += len(match.group(1))
         else:
@@ -427,28 +634,59 @@ class BazelBuildBridge(object):
 
   BUILD_EVENTS_FILE = 'build_events.json'
 
+  # Environment variables that Xcode always sets for the script.
+  _REQUIRED_ENV_VARS = [
+      'ACTION',
+      'BUILT_PRODUCTS_DIR',
+      'CODESIGNING_FOLDER_PATH',
+      'EXECUTABLE_PATH',
+      'FULL_PRODUCT_NAME',
+      'PLATFORM_NAME',
+      'PRODUCT_TYPE',
+      'PROJECT_DIR',
+      'PROJECT_FILE_PATH',
+      'TARGET_BUILD_DIR',
+      'TULSI_WR',
+      'XCODE_VERSION_MAJOR',
+  ]
+
   def __init__(self, build_settings):
+    # Read everything from a single snapshot of the environment, after making
+    # sure that all of the required variables are present. The snapshot is
+    # kept for the variables read later on in the build.
+    env = dict(os.environ)
+    missing_env_vars = [x for x in self._REQUIRED_ENV_VARS if x not in env]
+    if missing_env_vars:
+      _PrintXcodeError('Tulsi requires env variables %s to be set.  Please '
+                       'file a bug against Tulsi.'
+                       % ', '.join(missing_env_vars))
+      sys.exit(1)
+
+    self.env = env
     self.build_settings = build_settings
     self.verbose = 0
     self.bazel_bin_path = None
+    # CodesignBundleAttributes keyed by the signed bundle's (st_dev, st_ino).
     self.codesign_attributes = {}
+    # Source maps from _ExtractTargetSourceMap, keyed by normalize.
+    self.target_source_maps = {}
 
-    self.codesigning_folder_path = os.environ['CODESIGNING_FOLDER_PATH']
+    self.codesigning_folder_path = env['CODESIGNING_FOLDER_PATH']
 
-    self.xcode_action = os.environ['ACTION']  # The Xcode build action.
+    self.xcode_action = env['ACTION']  # The Xcode build action.
     # When invoked as an external build system script, Xcode will set ACTION to
     # an empty string.
     if not self.xcode_action:
       self.xcode_action = 'build'
 
-    if int(os.environ['XCODE_VERSION_MAJOR']) < 900:
-      xcode_build_version = os.environ['XCODE_PRODUCT_BUILD_VERSION']
+    if int(env['XCODE_VERSION_MAJOR']) < 900:
+      xcode_build_version = env['XCODE_PRODUCT_BUILD_VERSION']
       _PrintXcodeWarning('Tulsi officially supports Xcode 9+. You are using an '
                          'earlier Xcode, build %s.' % xcode_build_version)
 
-    self.tulsi_version = os.environ.get('TULSI_VERSION', 'UNKNOWN')
+    self.tulsi_version = env.get('TULSI_VERSION', 'UNKNOWN')
 
-    self.custom_lldbinit = os.environ.get('TULSI_LLDBINIT_FILE')
+    self.custom_lldbinit = env.get('TULSI_LLDBINIT_FILE')
 
     # TODO(b/69857078): Remove this when wrapped_clang is updated.
     self.direct_debug_prefix_map = False
@@ -459,7 +697,7 @@ class BazelBuildBridge(object):
     # Target architecture.  Must be defined for correct setting of
     # the --cpu flag. Note that Xcode will set multiple values in
     # ARCHS when building for a Generic Device.
-    archs = os.environ.get('ARCHS')
+    archs = env.get('ARCHS')
     if not archs:
       _PrintXcodeError('Tulsi requires env variable ARCHS to be '
                        'set.  Please file a bug against Tulsi.')
@@ -467,33 +705,37 @@ class BazelBuildBridge(object):
     self.arch = archs.split()[-1]
 
     # Path into which generated artifacts should be copied.
-    self.built_products_dir = os.environ['BUILT_PRODUCTS_DIR']
+    self.built_products_dir = env['BUILT_PRODUCTS_DIR']
     # Path where Xcode expects generated sources to be placed.
-    self.derived_sources_folder_path = os.environ.get('DERIVED_SOURCES_DIR')
+    self.derived_sources_folder_path = env.get('DERIVED_SOURCES_DIR')
     # Full name of the target artifact (e.g., "MyApp.app" or "Test.xctest").
-    self.full_product_name = os.environ['FULL_PRODUCT_NAME']
+    self.full_product_name = env['FULL_PRODUCT_NAME']
     # Whether to generate runfiles for this target.
-    self.gen_runfiles = os.environ.get('GENERATE_RUNFILES')
+    self.gen_runfiles = env.get('GENERATE_RUNFILES')
     # Target SDK version.
-    self.sdk_version = os.environ.get('SDK_VERSION')
+    self.sdk_version = env.get('SDK_VERSION')
     # TEST_HOST for unit tests.
-    self.test_host_binary = os.environ.get('TEST_HOST')
+    self.test_host_binary = env.get('TEST_HOST')
     # Whether this target is a test or not.
-    self.is_test = os.environ.get('WRAPPER_EXTENSION') == 'xctest'
+    self.is_test = env.get('WRAPPER_EXTENSION') == 'xctest'
     # Target platform.
-    self.platform_name = os.environ['PLATFORM_NAME']
+    self.platform_name = env['PLATFORM_NAME']
     # Type of the target artifact.
-    self.product_type = os.environ['PRODUCT_TYPE']
+    self.product_type = env['PRODUCT_TYPE']
     # Path to the parent of the xcodeproj bundle.
-    self.project_dir = os.environ['PROJECT_DIR']
+    self.project_dir = env['PROJECT_DIR']
     # Path to the xcodeproj bundle.
-    self.project_file_path = os.environ['PROJECT_FILE_PATH']
+    self.project_file_path = env['PROJECT_FILE_PATH']
+    # Path to the directory holding Tulsi's files within the xcodeproj bundle.
+    self.tulsi_dir = os.path.join(self.project_file_path, '.tulsi')
     # Path to the directory containing the WORKSPACE file.
-    self.workspace_root = os.path.abspath(os.environ['TULSI_WR'])
+    self.workspace_root = os.path.abspath(env['TULSI_WR'])
+    # The workspace root in the form used for source maps, see _NormalizePath.
+    self.normalized_workspace_root = self._NormalizePath(self.workspace_root)
     # Set to the name of the generated bundle for bundle-type targets, None for
     # single file targets (like static libraries).
-    self.wrapper_name = os.environ.get('WRAPPER_NAME')
-    self.wrapper_suffix = os.environ.get('WRAPPER_SUFFIX', '')
+    self.wrapper_name = env.get('WRAPPER_NAME')
+    self.wrapper_suffix = env.get('WRAPPER_SUFFIX', '')
 
     # Path where Xcode expects the artifacts to be written to. This is not the
     # codesigning_path as device vs simulator builds have different signing
@@ -507,32 +749,33 @@ class BazelBuildBridge(object):
     # the expected location for a single artifact output.
     # TODO(b/35811023): Check these paths are still valid.
     self.artifact_output_path = os.path.join(
-        os.environ['TARGET_BUILD_DIR'],
-        os.environ['FULL_PRODUCT_NAME'])
+        env['TARGET_BUILD_DIR'],
+        env['FULL_PRODUCT_NAME'])
 
     # Path to where Xcode expects the binary to be placed.
     self.binary_path = os.path.join(
-        os.environ['TARGET_BUILD_DIR'], os.environ['EXECUTABLE_PATH'])
+        env['TARGET_BUILD_DIR'], env['EXECUTABLE_PATH'])
 
     self.is_simulator = self.platform_name.endswith('simulator')
+    self.is_macos = self.platform_name.startswith('macos')
     # Check to see if code signing actions should be skipped or not.
     if self.is_simulator:
       self.codesigning_allowed = False
     else:
-      self.codesigning_allowed = os.environ.get('CODE_SIGNING_ALLOWED') == 'YES'
+      self.codesigning_allowed = env.get('CODE_SIGNING_ALLOWED') == 'YES'
 
     if self.codesigning_allowed:
-      platform_prefix = 'iOS'
-      if self.platform_name.startswith('macos'):
-        platform_prefix = 'macOS'
+      platform_prefix = 'macOS' if self.is_macos else 'iOS'
       entitlements_filename = '%sXCTRunner.entitlements' % platform_prefix
-      self.runner_entitlements_template = os.path.join(self.project_file_path,
-                                                       '.tulsi',
+      self.runner_entitlements_template = os.path.join(self.tulsi_dir,
                                                        'Resources',
                                                        entitlements_filename)
 
     self.bazel_executable = None
 
+    # Threads running non-essential work that the build does not wait on.
+    self.background_tasks = []
+
   def Run(self, args):
     """Executes a Bazel build based on the environment and given arguments."""
     if self.xcode_action != 'build':
@@ -543,9 +786,8 @@ class BazelBuildBridge(object):
                             self.sdk_version,
                             self.platform_name,
                             self.arch)
-    timer = Timer('Parsing options', 'parsing_options').Start()
-    message, exit_code = parser.ParseOptions(args[1:])
-    timer.End()
+    with Timer('Parsing options', 'parsing_options'):
+      message, exit_code = parser.ParseOptions(args[1:])
     if exit_code:
       _PrintXcodeError('Option parsing failed: %s' % message)
       return exit_code
@@ -563,18 +805,14 @@ class BazelBuildBridge(object):
     # Path to the Build Events JSON file uses pid and is removed if the
     # build is successful.
     filename = '%d_%s' % (os.getpid(), BazelBuildBridge.BUILD_EVENTS_FILE)
-    self.build_events_file_path = os.path.join(
-        self.project_file_path,
-        '.tulsi',
-        filename)
+    self.build_events_file_path = os.path.join(self.tulsi_dir, filename)
 
     (command, retval) = self._BuildBazelCommand(parser)
     if retval:
       return retval
 
-    timer = Timer('Running Bazel', 'running_bazel').Start()
-    exit_code, outputs = self._RunBazelAndPatchOutput(command)
-    timer.End()
+    with Timer('Running Bazel', 'running_bazel'):
+      exit_code, outputs = self._RunBazelAndPatchOutput(command)
     if exit_code:
       _Fatal('Bazel build failed with exit code %d. Please check the build '
              'log in Report Navigator (⌘9) for more information.'
@@ -584,7 +822,7 @@ class BazelBuildBridge(object):
     post_bazel_timer = Timer('Total Tulsi Post-Bazel time', 'total_post_bazel')
     post_bazel_timer.Start()
 
-    if not os.path.exists(self.bazel_exec_root):
+    if not os.access(self.bazel_exec_root, os.F_OK):
       _Fatal('No Bazel execution root was found at %r. Debugging experience '
              'will be compromised. Please report a Tulsi bug.'
              % self.bazel_exec_root)
@@ -600,14 +838,13 @@ class BazelBuildBridge(object):
     if exit_code:
       return exit_code
 
-    # Generated headers are installed on a thread since we are launching
-    # a separate process to do so. This gives us clean timings.
+    # Generated headers are installed on a thread so that they are symlinked
+    # while the artifact is being installed. This also gives us clean timings.
     install_thread = threading.Thread(
-        target=self._InstallGeneratedHeaders, args=(outputs,))
+        target=self._InstallGeneratedHeaders, args=(outputs_data,))
     install_thread.start()
-    timer = Timer('Installing artifacts', 'installing_artifacts').Start()
-    exit_code = self._InstallArtifact(outputs_data)
-    timer.End()
+    with Timer('Installing artifacts', 'installing_artifacts'):
+      exit_code = self._InstallArtifact(outputs_data)
     install_thread.join()
     if exit_code:
       return exit_code
@@ -617,62 +854,79 @@ class BazelBuildBridge(object):
     if exit_code:
       return exit_code
 
-    if not dsym_paths:
-      # Clean any bundles from a previous build that can interfere with
-      # debugging in LLDB.
-      self._CleanExistingDSYMs()
-    else:
-      for path in dsym_paths:
+    # Starting with Xcode 8, .lldbinit files are honored during Xcode debugging
+    # sessions. This allows use of the target.source-map field to remap the
+    # debug symbol paths encoded in the binary to the paths expected by Xcode.
+    #
+    # This will not work with dSYM bundles, or a direct -fdebug-prefix-map from
+    # the Bazel-built locations to Xcode-visible sources.
+    #
+    # The .lldbinit only depends on whether dSYM bundles were installed, so it
+    # is updated while the dSYMs are remapped and test artifacts are re-signed.
+    clear_source_map = dsym_paths or self.direct_debug_prefix_map
+    lldbinit_errors = []
+
+    def UpdateLLDBInit():
+      # Exceptions are handed back to this thread with their traceback, so
+      # that they still fail the build once the update is joined below.
+      try:
+        self._UpdateLLDBInitAndReport(clear_source_map)
+      except Exception:  # pylint: disable=broad-except
+        lldbinit_errors.append(traceback.format_exc())
+
+    lldbinit_thread = threading.Thread(target=UpdateLLDBInit)
+    lldbinit_thread.start()
+    try:
+      if not dsym_paths:
+        # Clean any bundles from a previous build that can interfere with
+        # debugging in LLDB.
+        self._CleanExistingDSYMs()
+      else:
         # Starting with Xcode 9.x, a plist based remapping exists for dSYM
         # bundles that works with Swift as well as (Obj-)C(++).
         #
         # This solution also works for Xcode 8.x for (Obj-)C(++) but not
         # for Swift.
-        timer = Timer('Adding remappings as plists to dSYM',
-                      'plist_dsym').Start()
-        exit_code = self._PlistdSYMPaths(path)
-        timer.End()
+        with Timer('Adding remappings as plists to dSYMs', 'plist_dsym'):
+          exit_code = self._PlistdSYMPaths(dsym_paths)
         if exit_code:
           _PrintXcodeError('Remapping dSYMs process returned %i, please '
                            'report a Tulsi bug and attach a full Xcode '
                            'build log.' % exit_code)
           return exit_code
 
-    # Starting with Xcode 7.3, XCTests inject several supporting frameworks
-    # into the test host that need to be signed with the same identity as
-    # the host itself.
-    if (self.is_test and not self.platform_name.startswith('macos') and
-        self.codesigning_allowed):
-      exit_code = self._ResignTestArtifacts()
-      if exit_code:
-        return exit_code
-
-    # Starting with Xcode 8, .lldbinit files are honored during Xcode debugging
-    # sessions. This allows use of the target.source-map field to remap the
-    # debug symbol paths encoded in the binary to the paths expected by Xcode.
-    #
-    # This will not work with dSYM bundles, or a direct -fdebug-prefix-map from
-    # the Bazel-built locations to Xcode-visible sources.
-    timer = Timer('Updating .lldbinit', 'updating_lldbinit').Start()
-    clear_source_map = dsym_paths or self.direct_debug_prefix_map
-    exit_code = self._UpdateLLDBInit(clear_source_map)
-    timer.End()
-    if exit_code:
-      _PrintXcodeWarning('Updating .lldbinit action failed with code %d' %
-                         exit_code)
-
+      # Starting with Xcode 7.3, XCTests inject several supporting frameworks
+      # into the test host that need to be signed with the same identity as
+      # the host itself.
+      if self.is_test and not self.is_macos and self.codesigning_allowed:
+        # Embedded bundles may still be copied out of the installed bundle in
+        # the background, so finish that before re-signing inside of it.
+        self.JoinBackgroundTasks()
+        exit_code = self._ResignTestArtifacts()
+        if exit_code:
+          return exit_code
+    finally:
+      lldbinit_thread.join()
+      # Reported here so that the error is not lost when returning early.
+      if lldbinit_errors:
+        _PrintXcodeError('Updating .lldbinit failed.\n%s' % lldbinit_errors[0])
+    if lldbinit_errors:
+      return 1
+
+    # Work left running in the background is part of the post-Bazel time.
+    self.JoinBackgroundTasks()
     post_bazel_timer.End(log_absolute_times=True)
 
     return 0
 
   def _BuildBazelCommand(self, options):
     """Builds up a commandline string suitable for running Bazel."""
-    configuration = os.environ['CONFIGURATION']
+    configuration = self.env['CONFIGURATION']
     # Treat the special testrunner build config as a Debug compile.
     test_runner_config_prefix = '__TulsiTestRunner_'
     if configuration.startswith(test_runner_config_prefix):
       configuration = configuration[len(test_runner_config_prefix):]
-    elif os.environ.get('TULSI_TEST_RUNNER_ONLY') == 'YES':
+    elif self.env.get('TULSI_TEST_RUNNER_ONLY') == 'YES':
       _PrintXcodeError('Building test targets with configuration "%s" is not '
                        'allowed. Please use the "Test" action or "Build for" > '
                        '"Testing" instead.' % configuration)
@@ -683,29 +937,24 @@ class BazelBuildBridge(object):
       return (None, 1)
 
     bazel, start_up, build = options.GetBazelOptions(configuration)
-    bazel_command = [bazel]
-    bazel_command.extend(start_up)
-    bazel_command.append('build')
-    bazel_command.extend(build)
 
-    bazel_command.extend([
+    if self.is_test and self.gen_runfiles:
+      output_groups_flag = '--output_groups=+tulsi_outputs'
+    else:
+      output_groups_flag = '--output_groups=tulsi_outputs,default'
+
+    extra_options = bazel_options.BazelOptions(self.env)
+
+    bazel_command = [bazel] + start_up + ['build'] + build + [
         # The following flags are used by Tulsi to identify itself and read
         # build information from Bazel. They shold not affect Bazel anaylsis
         # caching.
         '--tool_tag=tulsi:bazel_build',
         '--build_event_json_file=%s' % self.build_events_file_path,
         '--noexperimental_build_event_json_file_path_conversion',
-        '--aspects', '@tulsi//:tulsi/tulsi_aspects.bzl%tulsi_outputs_aspect'])
-
-    if self.is_test and self.gen_runfiles:
-      bazel_command.append('--output_groups=+tulsi_outputs')
-    else:
-      bazel_command.append('--output_groups=tulsi_outputs,default')
-
-    bazel_command.extend(options.targets)
-
-    extra_options = bazel_options.BazelOptions(os.environ)
-    bazel_command.extend(extra_options.bazel_feature_flags())
+        '--aspects', '@tulsi//:tulsi/tulsi_aspects.bzl%tulsi_outputs_aspect',
+        output_groups_flag,
+    ] + options.targets + extra_options.bazel_feature_flags()
 
     return (bazel_command, 0)
 
@@ -716,54 +965,43 @@ class BazelBuildBridge(object):
                        (' '.join([pipes.quote(x) for x in command]),
                         self.workspace_root,
                         self.project_dir))
-    # Clean up bazel output to make it look better in Xcode.
-    bazel_line_regex = re.compile(
-        r'(INFO|DEBUG|WARNING|ERROR|FAILED): ([^:]+:\d+:(?:\d+:)?)\s+(.+)')
-
-    bazel_generic_regex = re.compile(r'(INFO|DEBUG|WARNING|ERROR|FAILED): (.*)')
+    # These run for every line of build output, so look them up only once.
+    match_bazel_diagnostic = _BAZEL_DIAGNOSTIC_RE.match
+    match_xcode_parsable_line = _XCODE_PARSABLE_LINE_RE.match
+    workspace_root = self.workspace_root
 
+    # Clean up bazel output to make it look better in Xcode.
     def PatchBazelDiagnosticStatements(output_line):
       """Make Bazel output more Xcode friendly."""
-
-      def BazelLabelToXcodeLabel(bazel_label):
-        """Map Bazel labels to xcode labels for build output."""
-        xcode_labels = {
-            'INFO': 'note',
-            'DEBUG': 'note',
-            'WARNING': 'warning',
-            'ERROR': 'error',
-            'FAILED': 'error'
-        }
-        return xcode_labels.get(bazel_label, bazel_label)
-
-      match = bazel_line_regex.match(output_line)
-      if match:
-        xcode_label = BazelLabelToXcodeLabel(match.group(1))
-        output_line = '%s %s: %s' % (match.group(2), xcode_label,
-                                     match.group(3))
-      else:
-        match = bazel_generic_regex.match(output_line)
-        if match:
-          xcode_label = BazelLabelToXcodeLabel(match.group(1))
-          output_line = '%s: %s' % (xcode_label, match.group(2))
-      return output_line
+      if not output_line.startswith(_BAZEL_DIAGNOSTIC_PREFIXES):
+        return output_line
+      match = match_bazel_diagnostic(output_line)
+      if not match:
+        return output_line
+      bazel_label, location, message, generic_message = match.groups()
+      xcode_label = _BAZEL_TO_XCODE_LABELS[bazel_label]
+      if location is not None:
+        return '%s %s: %s' % (location, xcode_label, message)
+      return '%s: %s' % (xcode_label, generic_message)
 
     if self.workspace_root != self.project_dir:
-      # Match (likely) filename:line_number: lines.
-      xcode_parsable_line_regex = re.compile(r'([^/][^:]+):\d+:')
-
       def PatchOutputLine(output_line):
         output_line = PatchBazelDiagnosticStatements(output_line)
-        if xcode_parsable_line_regex.match(output_line):
-          output_line = '%s/%s' % (self.workspace_root, output_line)
+        # Xcode-parsable lines always contain a colon; skip the regex for
+        # the rest.
+        if ':' in output_line and match_xcode_parsable_line(output_line):
+          output_line = '%s/%s' % (workspace_root, output_line)
         return output_line
       patch_xcode_parsable_line = PatchOutputLine
     else:
       patch_xcode_parsable_line = PatchBazelDiagnosticStatements
 
     def HandleOutput(output):
-      for line in output.splitlines():
-        _logger.log_bazel_message(patch_xcode_parsable_line(line))
+      # Log each chunk of output as a single message, rather than line by line,
+      # to avoid per-line logging and flushing overhead.
+      lines = [patch_xcode_parsable_line(line) for line in output.splitlines()]
+      if lines:
+        _logger.log_bazel_message('\n'.join(lines))
 
     def WatcherUpdate(watcher):
       """Processes any new events in the given watcher.
@@ -795,11 +1033,12 @@ class BazelBuildBridge(object):
     open(self.build_events_file_path, 'w').close()
 
     # Capture the stderr and stdout from Bazel. We only display it if it we're
-    # unable to read any BEP events.
+    # unable to read any BEP events. The output is read in bulk rather than by
+    # line, so use a large buffer to keep the number of pipe reads down.
     process = subprocess.Popen(command,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.STDOUT,
-                               bufsize=1)
+                               bufsize=65536)
 
     # Register atexit function to clean up BEP file.
     atexit.register(_BEPFileExitCleanup, self.build_events_file_path)
@@ -813,8 +1052,9 @@ class BazelBuildBridge(object):
     reader_thread.daemon = True
     reader_thread.start()
 
-    with io.open(self.build_events_file_path, 'r', -1, 'utf-8', 'ignore'
-                ) as bep_file:
+    # The BEP file is read in binary mode; events are only decoded from UTF-8
+    # as part of JSON parsing.
+    with io.open(self.build_events_file_path, 'rb') as bep_file:
       watcher = bazel_build_events.BazelBuildEventsWatcher(bep_file,
                                                            _PrintXcodeWarning)
       output_locations = []
@@ -891,13 +1131,11 @@ class BazelBuildBridge(object):
     # Tulsi to disambiguate multiple targets with the same name.
     self.bazel_product_name = bundle_name
 
-    # We need to handle IPAs (from {ios, tvos}_application) differently from
-    # ZIPs (from the other bundled rules) because they output slightly different
-    # directory structures.
-    is_ipa = primary_artifact.endswith('.ipa')
-    is_zip = primary_artifact.endswith('.zip')
-
-    if is_ipa or is_zip:
+    if primary_artifact.endswith(('.ipa', '.zip')):
+      # We need to handle IPAs (from {ios, tvos}_application) differently from
+      # ZIPs (from the other bundled rules) because they output slightly
+      # different directory structures.
+      is_ipa = primary_artifact.endswith('.ipa')
       expected_bundle_name = bundle_name + self.wrapper_suffix
 
       # The directory structure within the IPA is then determined based on
@@ -950,17 +1188,18 @@ class BazelBuildBridge(object):
       # is from the bazel output, they come with bazel's permissions, which are
       # read only. Here we set them to write as well, so Xcode can modify the
       # bundle too (for example, for codesigning).
-      chmod_timer = Timer('Modifying permissions of output bundle',
-                          'bundle_chmod').Start()
-
-      self._PrintVerbose('Spawning subprocess to add write permissions to '
-                         'copied bundle...')
-      process = subprocess.Popen(['chmod', '-R', 'uga+w', xcode_artifact_path])
-      process.wait()
-      chmod_timer.End()
-
-    # No return code check as this is not an essential operation.
-    self._InstallEmbeddedBundlesIfNecessary(primary_output_data)
+      with Timer('Modifying permissions of output bundle', 'bundle_chmod'):
+        self._PrintVerbose('Spawning subprocess to add write permissions to '
+                           'copied bundle...')
+        process = subprocess.Popen(['chmod', '-R', 'uga+w',
+                                    xcode_artifact_path])
+        process.wait()
+
+    # No return code check as this is not an essential operation, so it doesn't
+    # hold up the build. Run joins it before re-signing the installed bundle it
+    # may copy from.
+    self._RunInBackground(self._InstallEmbeddedBundlesIfNecessary,
+                          primary_output_data)
 
     return 0
 
@@ -987,6 +1226,60 @@ class BazelBuildBridge(object):
       return False
     return os.path.getmtime(archive_root) > os.path.getmtime(unprocessed_zip)
 
+  def _RunInBackground(self, target, *args):
+    """Runs target(*args) on a thread that is joined by JoinBackgroundTasks.
+
+    Any exception raised by target is reported as a warning.
+    """
+    def RunTask():
+      try:
+        target(*args)
+      except Exception as e:  # pylint: disable=broad-except
+        _PrintXcodeWarning('Background task %s failed. %s' %
+                           (target.__name__, e))
+
+    thread = threading.Thread(target=RunTask)
+    thread.start()
+    self.background_tasks.append(thread)
+
+  def JoinBackgroundTasks(self):
+    """Waits for all of the work started by _RunInBackground to finish."""
+    while self.background_tasks:
+      self.background_tasks.pop().join()
+
+  def _RemoveStaleDirectory(self, path):
+    """Removes the directory at path, deleting its contents in the background.
+
+    The directory is first renamed so that path can be reused right away, which
+    lets deleting a large stale bundle overlap with installing its replacement.
+    Failures to delete the renamed directory are reported as warnings.
+
+    Args:
+      path: The directory to remove.
+
+    Raises:
+      OSError: If the directory could neither be moved out of the way nor
+               removed in place.
+    """
+    stale_path = '%s.tulsi_stale_%d' % (path, os.getpid())
+    try:
+      os.rename(path, stale_path)
+    except OSError:
+      shutil.rmtree(path)
+      return
+
+    failed_paths = []
+
+    def ReportRemovalError(unused_function, failed_path, exc_info):
+      # Only the first failure is reported, as a read-only directory makes
+      # removing every file inside of it fail the same way.
+      failed_paths.append(failed_path)
+      if len(failed_paths) == 1:
+        _PrintXcodeWarning('Failed to remove stale directory "%s". %s' %
+                           (stale_path, exc_info[1]))
+
+    self._RunInBackground(shutil.rmtree, stale_path, False, ReportRemovalError)
+
   def _InstallEmbeddedBundlesIfNecessary(self, output_data):
     """Install embedded bundles next to the current target's output."""
 
@@ -1001,34 +1294,30 @@ class BazelBuildBridge(object):
     if self.is_simulator or ('embedded_bundles' not in output_data):
       return
 
-    timer = Timer('Installing embedded bundles',
-                  'installing_embedded_bundles').Start()
-
-    for bundle_info in output_data['embedded_bundles']:
-      bundle_name = bundle_info['bundle_name']
-      bundle_extension = bundle_info['bundle_extension']
-      full_name = bundle_name + bundle_extension
-      output_path = os.path.join(self.built_products_dir, full_name)
-      # TODO(b/68936732): See if copying just the binary (not the whole bundle)
-      # is enough to make Instruments work.
-      if self._IsValidArtifactArchiveRoot(bundle_info['archive_root'],
-                                          bundle_name):
-        source_path = os.path.join(bundle_info['archive_root'], full_name)
-        self._RsyncBundle(full_name, source_path, output_path)
-      else:
-        # Try to find the embedded bundle within the installed main bundle.
-        bundle_path = self._FindEmbeddedBundleInMain(bundle_name,
-                                                     bundle_extension)
-        if bundle_path:
-          self._RsyncBundle(full_name, bundle_path, output_path)
+    with Timer('Installing embedded bundles', 'installing_embedded_bundles'):
+      for bundle_info in output_data['embedded_bundles']:
+        bundle_name = bundle_info['bundle_name']
+        bundle_extension = bundle_info['bundle_extension']
+        full_name = bundle_name + bundle_extension
+        output_path = os.path.join(self.built_products_dir, full_name)
+        # TODO(b/68936732): See if copying just the binary (not the whole
+        # bundle) is enough to make Instruments work.
+        if self._IsValidArtifactArchiveRoot(bundle_info['archive_root'],
+                                            bundle_name):
+          source_path = os.path.join(bundle_info['archive_root'], full_name)
+          self._RsyncBundle(full_name, source_path, output_path)
         else:
-          _PrintXcodeWarning('Could not find bundle %s in main bundle. ' %
-                             (full_name) +
-                             'Device-level Instruments debugging will be '
-                             'disabled for this bundle. Please report a '
-                             'Tulsi bug and attach a full Xcode build log.')
-
-    timer.End()
+          # Try to find the embedded bundle within the installed main bundle.
+          bundle_path = self._FindEmbeddedBundleInMain(bundle_name,
+                                                       bundle_extension)
+          if bundle_path:
+            self._RsyncBundle(full_name, bundle_path, output_path)
+          else:
+            _PrintXcodeWarning('Could not find bundle %s in main bundle. ' %
+                               (full_name) +
+                               'Device-level Instruments debugging will be '
+                               'disabled for this bundle. Please report a '
+                               'Tulsi bug and attach a full Xcode build log.')
 
   # Maps extensions to anticipated subfolders.
   _EMBEDDED_BUNDLE_PATHS = {
@@ -1038,7 +1327,7 @@ class BazelBuildBridge(object):
 
   def _FindEmbeddedBundleInMain(self, bundle_name, bundle_extension):
     """Retrieves the first embedded bundle found within our main bundle."""
-    main_bundle = os.environ.get('EXECUTABLE_FOLDER_PATH')
+    main_bundle = self.env.get('EXECUTABLE_FOLDER_PATH')
 
     if not main_bundle:
       return None
@@ -1089,23 +1378,16 @@ class BazelBuildBridge(object):
         return path
     return None
 
-  def _InstallGeneratedHeaders(self, outputs):
-    """Invokes install_genfiles.py to install generated Bazel files."""
-    genfiles_timer = Timer('Installing generated headers',
-                           'installing_generated_headers').Start()
-    # Resolve the path to the install_genfiles.py script.
-    # It should be in the same directory as this script.
-    path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                        'install_genfiles.py')
-
-    args = [path, self.bazel_exec_root]
-    args.extend(outputs)
-
-    self._PrintVerbose('Spawning subprocess install_genfiles.py to copy '
-                       'generated files in the background...')
-    process = subprocess.Popen(args)
-    process.wait()
-    genfiles_timer.End()
+  def _InstallGeneratedHeaders(self, outputs_data):
+    """Symlinks generated Bazel files listed in the aspect outputs data."""
+    with Timer('Installing generated headers', 'installing_generated_headers'):
+      # The aspect outputs have already been parsed, so install the generated
+      # files in-process instead of having install_genfiles.py load them again.
+      self._PrintVerbose('Installing generated files in the background...')
+      try:
+        Installer(self.bazel_exec_root).InstallForOutputsData(outputs_data)
+      except (IOError, KeyError, OSError) as e:
+        _PrintXcodeWarning('Failed to install generated files. %s' % e)
 
   def _InstallBundle(self, source_path, output_path):
     """Copies the bundle at source_path to output_path."""
@@ -1114,7 +1396,7 @@ class BazelBuildBridge(object):
 
     if os.path.isdir(output_path):
       try:
-        shutil.rmtree(output_path)
+        self._RemoveStaleDirectory(output_path)
       except OSError as e:
         _PrintXcodeError('Failed to remove stale bundle ""%s". '
                          '%s' % (output_path, e))
@@ -1133,20 +1415,16 @@ class BazelBuildBridge(object):
     if not full_source_path.endswith('/'):
       full_source_path += '/'
 
-    try:
-      # Use -c to check differences by checksum, -v for verbose,
-      # and --delete to delete stale files.
-      # The rest of the flags are the same as -a but without preserving
-      # timestamps, which is done intentionally so the timestamp will
-      # only change when the file is changed.
-      subprocess.check_output(['rsync',
-                               '-vcrlpgoD',
-                               '--delete',
-                               full_source_path,
-                               output_path],
-                              stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as e:
-      _PrintXcodeError('Rsync failed. %s' % e)
+    # Use -c to check differences by checksum and --delete to delete stale
+    # files. The rest of the flags are the same as -a but without preserving
+    # timestamps, which is done intentionally so the timestamp will only
+    # change when the file is changed. rsync's output is never looked at, so
+    # it is discarded instead of being buffered.
+    command = ['rsync', '-crlpgoD', '--delete', full_source_path, output_path]
+    returncode, _ = self._RunSubprocess(command, capture=False)
+    if returncode:
+      _PrintXcodeError('Rsync failed. Command %r returned non-zero exit '
+                       'status %d' % (command, returncode))
       return 650
     return 0
 
@@ -1188,7 +1466,7 @@ class BazelBuildBridge(object):
 
     if os.path.isdir(output_path):
       try:
-        shutil.rmtree(output_path)
+        self._RemoveStaleDirectory(output_path)
       except OSError as e:
         _PrintXcodeError('Failed to remove stale output directory ""%s". '
                          '%s' % (output_path, e))
@@ -1198,15 +1476,25 @@ class BazelBuildBridge(object):
     # ZIPs (from the other bundled rules) because they output slightly different
     # directory structures.
     is_ipa = bundle_path.endswith('.ipa')
-
-    with zipfile.ZipFile(bundle_path, 'r') as zf:
+    # Target paths are built by concatenation, as os.path.join is comparatively
+    # slow for the thousands of entries found in large bundles.
+    output_prefix = os.path.join(output_path, '')
+
+    # Map the archive into memory, so that reading its members is served
+    # straight from the page cache instead of through buffered file reads.
+    archive = _MapFile(bundle_path)
+    with contextlib.closing(archive):
+      zf = zipfile.ZipFile(_MappedFile(archive), 'r')
+      files_to_extract = []
+      file_dirs = set()
+      created_dirs = set()
       for item in zf.infolist():
         filename = item.filename
 
         # Support directories do not seem to be needed by the debugger and are
         # skipped.
-        basedir = filename.split(os.sep)[0]
-        if basedir.endswith('Support') or basedir.endswith('Support2'):
+        basedir, _, subpath = filename.partition(os.sep)
+        if basedir.endswith(('Support', 'Support2')):
           continue
 
         if len(filename) < len(bundle_subpath):
@@ -1221,38 +1509,101 @@ class BazelBuildBridge(object):
                              'at "%s" expected to have subpath of "%s"' %
                              (filename, bundle_subpath))
 
-        dir_components = self._SplitPathComponents(filename)
-
-        # Get the file's path, ignoring the payload components if the archive
-        # is an IPA.
+        # Get the file's path within the bundle, also stripping the Payload
+        # directory if the archive is an IPA.
         if is_ipa:
-          subpath = os.path.join(*dir_components[2:])
-        else:
-          subpath = os.path.join(*dir_components[1:])
-        target_path = os.path.join(output_path, subpath)
+          subpath = subpath.partition(os.sep)[2]
+        target_path = output_prefix + subpath
 
-        # Ensure the target directory exists.
-        try:
-          target_dir = os.path.dirname(target_path)
-          if not os.path.isdir(target_dir):
-            os.makedirs(target_dir)
-        except OSError as e:
-          _PrintXcodeError(
-              'Failed to create target path "%s" during extraction. %s' % (
-                  target_path, e))
+        # Files are extracted concurrently below, everything else is handled
+        # here, in archive order.
+        if not filename.endswith(os.sep):
+          files_to_extract.append((item, target_path, attributes))
+          file_dirs.add(os.path.dirname(target_path))
+          continue
+
+        target_dir = os.path.dirname(target_path)
+        if not self._MakeExtractionDir(target_dir):
           return 671
+        created_dirs.add(target_dir)
 
-        # If the archive item looks like a file, extract it.
-        if not filename.endswith(os.sep):
-          with zf.open(item) as src, file(target_path, 'wb') as dst:
-            shutil.copyfileobj(src, dst)
+        # Patch up the extracted directory's attributes to match the zip
+        # content.
+        if attributes:
+          os.chmod(target_path, attributes)
+
+      # Create the directories of all files up front, so that the threads
+      # extracting them never race on creating the same directory. Each one is
+      # only checked once, skipping those made for directory entries above.
+      for target_dir in sorted(file_dirs - created_dirs):
+        if not self._MakeExtractionDir(target_dir):
+          return 671
+
+      # Decompressing and writing files releases the GIL, so extract them on a
+      # pool of threads. Stored and deflated members are read straight from
+      # the memory map, using the ZipInfo entries read above. Any other member
+      # is read through the ZipFile, one at a time, as a ZipFile's reads share
+      # the position of its file object.
+      zf_lock = threading.Lock()
+
+      def WriteMember(item, fd):
+        # Empty members need nothing beyond creating the file.
+        if not item.file_size:
+          return
+        raw_data = _RawMemberData(archive, item)
+        if raw_data is None:
+          # Copy in large chunks, as bundles are mostly made up of
+          # multi-megabyte binaries and asset catalogs.
+          copy_size = min(item.file_size, _EXTRACTION_COPY_SIZE)
+          with zf_lock, zf.open(item) as src:
+            while True:
+              chunk = src.read(copy_size)
+              if not chunk:
+                break
+              _WriteAll(fd, chunk)
+          return
+        if item.compress_type == zipfile.ZIP_STORED:
+          _WriteAll(fd, raw_data)
+          crc = zlib.crc32(raw_data)
+        else:
+          crc = _InflateTo(raw_data, fd)
+        # Check the data as ZipFile's own reads do.
+        if crc & 0xffffffff != item.CRC:
+          raise zipfile.BadZipfile('Bad CRC-32 for file %r' % item.filename)
+
+      def ExtractFile(file_info):
+        item, target_path, attributes = file_info
+        # Members are written in a few large writes, so skip the buffering of
+        # a file object and write to the descriptor directly.
+        fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+          WriteMember(item, fd)
+        finally:
+          os.close(fd)
 
         # Patch up the extracted file's attributes to match the zip content.
         if attributes:
           os.chmod(target_path, attributes)
 
+      # Failures raise, as extracting through ZipFile does.
+      _ParallelMap(ExtractFile, files_to_extract)
+
     return 0
 
+  @staticmethod
+  def _MakeExtractionDir(target_dir):
+    """Ensures the given directory exists, returning success."""
+    if os.path.isdir(target_dir):
+      return True
+    try:
+      os.makedirs(target_dir)
+    except OSError as e:
+      _PrintXcodeError(
+          'Failed to create target path "%s" during extraction. %s' % (
+              target_dir, e))
+      return False
+    return True
+
   def _InstallDSYMBundles(self, output_dir, outputs_data):
     """Copies any generated dSYM bundles to the given directory."""
 
@@ -1266,7 +1617,7 @@ class BazelBuildBridge(object):
       # Note that this may differ from the Bazel name as Tulsi may modify the
       # Xcode `BUNDLE_NAME`, so we need to make sure we use Bazel as the source
       # of truth for Bazel's dSYM name, but copy it over to where Xcode expects.
-      xcode_target_dsym = os.environ.get('DWARF_DSYM_FILE_NAME')
+      xcode_target_dsym = self.env.get('DWARF_DSYM_FILE_NAME')
 
       if xcode_target_dsym:
         dsym_path = primary_output_data.get('dsym_path')
@@ -1296,24 +1647,28 @@ class BazelBuildBridge(object):
     if not dsym_to_process:
       return 0, None
 
-    # Start the timer now that we know we have dSYM bundles to install.
-    timer = Timer('Installing dSYM bundles', 'installing_dsym').Start()
-
-    dsyms_found = []
-    for input_dsym_full_path, xcode_dsym_name in dsym_to_process:
+    def InstallDSYM(dsym_info):
+      input_dsym_full_path, xcode_dsym_name = dsym_info
       output_full_path = os.path.join(output_dir, xcode_dsym_name)
-      exit_code, path = self._InstallBundle(input_dsym_full_path,
-                                            output_full_path)
-      if exit_code:
-        _PrintXcodeWarning('Failed to install dSYM to "%s" (%s)'
-                           % (input_dsym_full_path, exit_code))
-      elif path is None:
-        _PrintXcodeWarning('Did not find a dSYM bundle at %s'
-                           % input_dsym_full_path)
-      else:
-        dsyms_found.append(path)
+      return self._InstallBundle(input_dsym_full_path, output_full_path)
 
-    timer.End()
+    # Start the timer now that we know we have dSYM bundles to install.
+    with Timer('Installing dSYM bundles', 'installing_dsym'):
+      # Every bundle is copied to its own location, so copy them concurrently.
+      dsym_to_process = list(dsym_to_process)
+      results = _ParallelMap(InstallDSYM, dsym_to_process)
+
+      dsyms_found = []
+      for (input_dsym_full_path, _), (exit_code, path) in zip(dsym_to_process,
+                                                              results):
+        if exit_code:
+          _PrintXcodeWarning('Failed to install dSYM to "%s" (%s)'
+                             % (input_dsym_full_path, exit_code))
+        elif path is None:
+          _PrintXcodeWarning('Did not find a dSYM bundle at %s'
+                             % input_dsym_full_path)
+        else:
+          dsyms_found.append(path)
     return 0, dsyms_found
 
   def _ResignBundle(self, bundle_path, signing_identity, entitlements=None):
@@ -1321,7 +1676,18 @@ class BazelBuildBridge(object):
     if not self.codesigning_allowed:
       return 0
 
-    timer = Timer('\tSigning ' + bundle_path, 'signing_bundle').Start()
+    with Timer('\tSigning ' + bundle_path, 'signing_bundle'):
+      command = self._CodesignCommand([bundle_path], signing_identity,
+                                      entitlements)
+      returncode, output = self._RunSubprocess(command)
+    if returncode:
+      _PrintXcodeError('Re-sign command %r failed. %s' % (command, output))
+      return 800 + returncode
+    return 0
+
+  @staticmethod
+  def _CodesignCommand(bundle_paths, signing_identity, entitlements=None):
+    """Returns a command re-signing all the given bundles the same way."""
     command = [
         'xcrun',
         'codesign',
@@ -1336,14 +1702,8 @@ class BazelBuildBridge(object):
     else:
       command.append('--preserve-metadata=entitlements')
 
-    command.append(bundle_path)
-
-    returncode, output = self._RunSubprocess(command)
-    timer.End()
-    if returncode:
-      _PrintXcodeError('Re-sign command %r failed. %s' % (command, output))
-      return 800 + returncode
-    return 0
+    command.extend(bundle_paths)
+    return command
 
   def _ResignTestArtifacts(self):
     """Resign test related artifacts that Xcode injected into the outputs."""
@@ -1356,33 +1716,30 @@ class BazelBuildBridge(object):
       return 800
 
     exit_code = 0
-    timer = Timer('Re-signing injected test host artifacts',
-                  'resigning_test_host').Start()
-
-    if self.test_host_binary:
-      # For Unit tests, we need to resign the frameworks that Xcode injected
-      # into the test host bundle.
-      test_host_bundle = os.path.dirname(self.test_host_binary)
-      exit_code = self._ResignXcodeTestFrameworks(
-          test_host_bundle, signing_identity)
-    else:
-      # For UI tests, we need to resign the UI test runner app and the
-      # frameworks that Xcode injected into the runner app. The UI Runner app
-      # also needs to be signed with entitlements.
-      exit_code = self._ResignXcodeTestFrameworks(
-          self.codesigning_folder_path, signing_identity)
-      if exit_code == 0:
-        entitlements_path = self._InstantiateUIRunnerEntitlements()
-        if entitlements_path:
-          exit_code = self._ResignBundle(
-              self.codesigning_folder_path,
-              signing_identity,
-              entitlements_path)
-        else:
-          _PrintXcodeError('Could not instantiate UI runner entitlements.')
-          exit_code = 800
-
-    timer.End()
+    with Timer('Re-signing injected test host artifacts',
+               'resigning_test_host'):
+      if self.test_host_binary:
+        # For Unit tests, we need to resign the frameworks that Xcode injected
+        # into the test host bundle.
+        test_host_bundle = os.path.dirname(self.test_host_binary)
+        exit_code = self._ResignXcodeTestFrameworks(
+            test_host_bundle, signing_identity)
+      else:
+        # For UI tests, we need to resign the UI test runner app and the
+        # frameworks that Xcode injected into the runner app. The UI Runner
+        # app also needs to be signed with entitlements.
+        exit_code = self._ResignXcodeTestFrameworks(
+            self.codesigning_folder_path, signing_identity)
+        if exit_code == 0:
+          entitlements_path = self._InstantiateUIRunnerEntitlements()
+          if entitlements_path:
+            exit_code = self._ResignBundle(
+                self.codesigning_folder_path,
+                signing_identity,
+                entitlements_path)
+          else:
+            _PrintXcodeError('Could not instantiate UI runner entitlements.')
+            exit_code = 800
     return exit_code
 
   def _ResignXcodeTestFrameworks(self, bundle, signing_identity):
@@ -1390,13 +1747,34 @@ class BazelBuildBridge(object):
     if not self.codesigning_allowed:
       return 0
 
+    framework_paths = []
     for framework in XCODE_INJECTED_FRAMEWORKS:
       framework_path = os.path.join(
           bundle, 'Frameworks', framework)
       if os.path.isdir(framework_path) or os.path.isfile(framework_path):
-        exit_code = self._ResignBundle(framework_path, signing_identity)
-        if exit_code != 0:
-          return exit_code
+        framework_paths.append(framework_path)
+    if not framework_paths:
+      return 0
+
+    # codesign accepts multiple paths, so sign all of the frameworks with a
+    # single invocation. Fall back to signing them one at a time if that fails
+    # in order to report which framework could not be signed.
+    with Timer('\tSigning injected frameworks in ' + bundle,
+               'signing_injected_frameworks'):
+      command = self._CodesignCommand(framework_paths, signing_identity)
+      returncode, output = self._RunSubprocess(command)
+    if not returncode:
+      return 0
+    self._PrintVerbose('Re-sign command %r failed, re-signing frameworks '
+                       'individually. %s' % (command, output))
+
+    # The frameworks are separate bundles, so they can be signed concurrently.
+    def ResignFramework(framework_path):
+      return self._ResignBundle(framework_path, signing_identity)
+
+    for exit_code in _ParallelMap(ResignFramework, framework_paths):
+      if exit_code != 0:
+        return exit_code
     return 0
 
   def _InstantiateUIRunnerEntitlements(self):
@@ -1449,23 +1827,37 @@ class BazelBuildBridge(object):
     if not self.codesigning_allowed:
       return '<CODE_SIGNING_ALLOWED=NO>'
 
-    cached = self.codesign_attributes.get(signed_bundle)
+    # Key on the bundle's inode, so that paths reaching the same bundle through
+    # different symlinks share a single codesign invocation.
+    try:
+      bundle_stat = os.stat(signed_bundle)
+      cache_key = (bundle_stat.st_dev, bundle_stat.st_ino)
+    except OSError:
+      cache_key = signed_bundle
+    cached = self.codesign_attributes.get(cache_key)
     if cached:
       return cached.Get(attribute)
 
-    timer = Timer('\tExtracting signature for ' + signed_bundle,
-                  'extracting_signature').Start()
-    output = subprocess.check_output(['xcrun',
-                                      'codesign',
-                                      '-dvv',
-                                      signed_bundle],
-                                     stderr=subprocess.STDOUT)
-    timer.End()
+    with Timer('\tExtracting signature for ' + signed_bundle,
+               'extracting_signature'):
+      output = subprocess.check_output(['xcrun',
+                                        'codesign',
+                                        '-dvv',
+                                        signed_bundle],
+                                       stderr=subprocess.STDOUT)
 
     bundle_attributes = CodesignBundleAttributes(output)
-    self.codesign_attributes[signed_bundle] = bundle_attributes
+    self.codesign_attributes[cache_key] = bundle_attributes
     return bundle_attributes.Get(attribute)
 
+  def _UpdateLLDBInitAndReport(self, clear_source_map):
+    """Updates lldbinit, warning about but otherwise ignoring any failure."""
+    with Timer('Updating .lldbinit', 'updating_lldbinit'):
+      exit_code = self._UpdateLLDBInit(clear_source_map)
+    if exit_code:
+      _PrintXcodeWarning('Updating .lldbinit action failed with code %d' %
+                         exit_code)
+
   def _UpdateLLDBInit(self, clear_source_map=False):
     """Updates lldbinit to enable debugging of Bazel binaries."""
 
@@ -1493,7 +1885,7 @@ class BazelBuildBridge(object):
       additional_lldbinit = _FindDefaultLldbInit()
 
     project_basename = os.path.basename(self.project_file_path)
-    workspace_root = self._NormalizePath(self.workspace_root)
+    workspace_root = self.normalized_workspace_root
 
     with open(lldbinit_file, 'w') as out:
       out.write('# This file is autogenerated by Tulsi and should not be '
@@ -1548,28 +1940,25 @@ class BazelBuildBridge(object):
                              'Resources',
                              'DWARF')
 
-    dsym_binaries = []
-
-    for f in os.listdir(dwarf_dir):
-      # Ignore hidden files, such as .DS_Store files.
-      if not f.startswith('.'):
-        # Append full path info.
-        dsym_binary = os.path.join(dwarf_dir, f)
-        dsym_binaries.append(dsym_binary)
-
-    return dsym_binaries
+    # Append full path info, ignoring hidden files such as .DS_Store files.
+    dwarf_prefix = dwarf_dir + os.sep
+    return [dwarf_prefix + f for f in os.listdir(dwarf_dir)
+            if not f.startswith('.')]
 
-  def _UUIDInfoForBinary(self, source_binary_path):
+  def _UUIDInfoForBinaries(self, source_binary_paths):
     """Returns exit code of dwarfdump along with every UUID + arch found.
 
+    A single dwarfdump invocation is used for all of the given binaries, as it
+    reports one line per binary slice for each of its file arguments.
+
     Args:
-      source_binary_path: absolute path to the binary file.
+      source_binary_paths: list of absolute paths to the binary files.
 
     Returns:
       (Int, str[(str, str)]): a tuple containing the return code of dwarfdump
                               as its first element, and a list of strings
                               representing each UUID found for each given
-                              binary slice found within the binary with its
+                              binary slice found within the binaries with its
                               given architecture, if no error has occcured.
     """
 
@@ -1577,50 +1966,37 @@ class BazelBuildBridge(object):
         'xcrun',
         'dwarfdump',
         '--uuid',
-        source_binary_path
-    ])
+    ] + source_binary_paths)
     if returncode:
-      _PrintXcodeWarning('dwarfdump returned %d while finding the UUID for %s'
-                         % (returncode, source_binary_path))
+      _PrintXcodeWarning('dwarfdump returned %d while finding the UUIDs for %s'
+                         % (returncode, ', '.join(source_binary_paths)))
       return (returncode, [])
 
     # All UUIDs for binary slices will be returned as the second from left,
     # from output; "UUID: D4DE5AA2-79EE-36FE-980C-755AED318308 (x86_64)
     # /Applications/Calendar.app/Contents/MacOS/Calendar"
 
-    uuids_found = []
-    for dwarfdump_output in output.split('\n'):
-      if not dwarfdump_output:
-        continue
-      found_output = re.match(r'^(?:UUID: )([^ ]+) \(([^)]+)', dwarfdump_output)
-      if not found_output:
-        continue
-      found_uuid = found_output.group(1)
-      if not found_uuid:
-        continue
-      found_arch = found_output.group(2)
-      if not found_arch:
-        continue
-      uuids_found.append((found_uuid, found_arch))
+    uuids_found = [match.groups()
+                   for match in _DWARFDUMP_UUID_RE.finditer(output)]
 
     return (0, uuids_found)
 
-  def _CreateUUIDPlist(self, dsym_bundle_path, uuid, arch, source_maps):
+  def _CreateUUIDPlist(self, dsym_bundle_path, uuid, plist_contents,
+                       existing_plist=None):
     """Creates a UUID.plist in a dSYM bundle to redirect sources.
 
     Args:
       dsym_bundle_path: absolute path to the dSYM bundle.
       uuid: string representing the UUID of the binary slice with paths to
             remap in the dSYM bundle.
-      arch: the architecture of the binary slice.
-      source_maps:  list of tuples representing all absolute paths to source
-                    files compiled by Bazel as strings ($0) associated with the
-                    paths to Xcode-visible sources used for the purposes of
-                    Tulsi debugging as strings ($1).
+      plist_contents: the serialized XML plist to write, as returned by
+                      _RemapPlistContents.
+      existing_plist: optional path to a plist already holding plist_contents,
+                      which is hard linked to instead of writing a new file.
 
     Returns:
-      Bool: True if no error was found, or False, representing a failure to
-            write when creating the plist.
+      str: the path to the plist created, or None, representing a failure to
+           write when creating the plist.
     """
 
     # Create a UUID plist at (dsym_bundle_path)/Contents/Resources/.
@@ -1628,42 +2004,50 @@ class BazelBuildBridge(object):
                                'Contents',
                                'Resources',
                                '%s.plist' % uuid)
-
-    # Via an XML plist, add the mappings from  _ExtractTargetSourceMap().
+    if existing_plist:
+      try:
+        os.link(existing_plist, remap_plist)
+        return remap_plist
+      except OSError:
+        pass  # Fall back to writing out the contents.
     try:
-      with open(remap_plist, 'w') as out:
-        out.write('<?xml version="1.0" encoding="UTF-8"?>\n'
-                  '<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" '
-                  '"http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n'
-                  '<plist version="1.0">\n'
-                  '<dict>\n'
-                  '<key>DBGSourcePathRemapping</key>\n'
-                  '<dict>\n')
-        for source_map in source_maps:
-          # Add the mapping as a DBGSourcePathRemapping to the UUID plist here.
-          out.write('<key>%s</key>\n<string>%s</string>\n' % source_map)
-
-        # Make sure that we also set DBGVersion to 3.
-        out.write('</dict>\n'
-                  '<key>DBGVersion</key>\n'
-                  '<string>3</string>\n'
-                  '</dict>\n'
-                  '</plist>\n')
-    except OSError as e:
+      with open(remap_plist, 'wb') as out:
+        out.write(plist_contents)
+    except (IOError, OSError) as e:
       _PrintXcodeError('Failed to write %s, received error %s' %
                        (remap_plist, e))
-      return False
+      return None
 
-    # Update the dSYM symbol cache with a reference to this dSYM bundle.
-    err_msg = self.update_symbol_cache.UpdateUUID(uuid,
-                                                  dsym_bundle_path,
-                                                  arch)
-    if err_msg:
-      _PrintXcodeWarning('Attempted to save (uuid, dsym_bundle_path, arch) '
-                         'to DBGShellCommands\' dSYM cache, but got error '
-                         '\"%s\".' % err_msg)
+    return remap_plist
 
-    return True
+  # Entries of the UUID plists that never change. DBGVersion 3 is the version
+  # that supports DBGSourcePathRemapping.
+  _REMAP_PLIST_TEMPLATE = {
+      'DBGVersion': '3',
+  }
+
+  def _RemapPlistContents(self, source_maps):
+    """Returns the contents of the UUID plists used to redirect sources.
+
+    The contents are the same for every binary slice of every dSYM bundle in
+    the build, so _PlistdSYMPaths serializes them once for all UUID plists.
+
+    Args:
+      source_maps:  list of tuples representing all absolute paths to source
+                    files compiled by Bazel as strings ($0) associated with the
+                    paths to Xcode-visible sources used for the purposes of
+                    Tulsi debugging as strings ($1).
+
+    Returns:
+      str: the XML plist, ready to be written to disk.
+    """
+    # Via an XML plist, add the mappings from  _ExtractTargetSourceMap() as a
+    # DBGSourcePathRemapping to the template. plistlib escapes the paths as
+    # needed.
+    remap_plist_data = dict(self._REMAP_PLIST_TEMPLATE)
+    remap_plist_data['DBGSourcePathRemapping'] = dict(source_maps)
+    # python2 API to plistlib - needs updating if/when Tulsi bumps to python3
+    return plistlib.writePlistToString(remap_plist_data)
 
   def _CleanExistingDSYMs(self):
     """Clean dSYM bundles that were left over from a previous build."""
@@ -1674,8 +2058,8 @@ class BazelBuildBridge(object):
       if item.endswith('.dSYM'):
         shutil.rmtree(os.path.join(output_dir, item))
 
-  def _PlistdSYMPaths(self, dsym_bundle_path):
-    """Adds Plists to a given dSYM bundle to redirect DWARF data."""
+  def _PlistdSYMPaths(self, dsym_bundle_paths):
+    """Adds Plists to the given dSYM bundles to redirect DWARF data."""
 
     # Retrieve the paths that we are expected to remap.
 
@@ -1685,7 +2069,45 @@ class BazelBuildBridge(object):
     # Remap relative paths from the workspace root.
     if self.normalized_prefix_map:
       # Take the normalized path and map that to Xcode-visible sources.
-      source_maps.append(('./', self._NormalizePath(self.workspace_root)))
+      source_maps.append(('./', self.normalized_workspace_root))
+
+    plist_contents = self._RemapPlistContents(source_maps)
+
+    # Every bundle is patched independently, running dwarfdump on its binaries,
+    # so patch them concurrently.
+    def PlistdSYMBundle(dsym_bundle_path):
+      return self._PlistdSYMBundle(dsym_bundle_path, plist_contents)
+
+    results = _ParallelMap(PlistdSYMBundle, dsym_bundle_paths)
+
+    # Update the dSYM symbol cache with a reference to each dSYM bundle. The
+    # cache's sqlite connection is bound to this thread, so this is serial.
+    for dsym_bundle_path, (exit_code, uuid_info_found) in zip(
+        dsym_bundle_paths, results):
+      if exit_code:
+        return exit_code
+      for uuid, arch in uuid_info_found:
+        err_msg = self.update_symbol_cache.UpdateUUID(uuid,
+                                                      dsym_bundle_path,
+                                                      arch)
+        if err_msg:
+          _PrintXcodeWarning('Attempted to save (uuid, dsym_bundle_path, arch) '
+                             'to DBGShellCommands\' dSYM cache, but got error '
+                             '\"%s\".' % err_msg)
+
+    return 0
+
+  def _PlistdSYMBundle(self, dsym_bundle_path, plist_contents):
+    """Adds a Plist to the given dSYM bundle for every binary slice in it.
+
+    Args:
+      dsym_bundle_path: absolute path to the dSYM bundle.
+      plist_contents: serialized contents of the plists to add.
+
+    Returns:
+      (int, [(str, str)]): the exit code of the operation, and the UUID and
+                           architecture of every binary slice found.
+    """
 
     # Find the binaries within the dSYM bundle. UUIDs will match that of the
     # binary it was based on.
@@ -1695,25 +2117,27 @@ class BazelBuildBridge(object):
       _PrintXcodeWarning('Could not find the binaries that the dSYM %s was '
                          'based on to determine DWARF binary slices to patch. '
                          'Debugging will probably fail.' % (dsym_bundle_path))
-      return 404
-
-    # Find the binary slice UUIDs with dwarfdump from each binary.
-    for source_binary_path in dsym_binaries:
-
-      returncode, uuid_info_found = self._UUIDInfoForBinary(source_binary_path)
-      if returncode:
-        return returncode
-
-      # Create a plist per UUID, each indicating a binary slice to remap paths.
-      for uuid, arch in uuid_info_found:
-        plist_created = self._CreateUUIDPlist(dsym_bundle_path,
-                                              uuid,
-                                              arch,
-                                              source_maps)
-        if not plist_created:
-          return 405
+      return 404, []
 
-    return 0
+    # Find the binary slice UUIDs with dwarfdump from all binaries at once.
+    returncode, uuid_info_found = self._UUIDInfoForBinaries(dsym_binaries)
+    if returncode:
+      return returncode, []
+
+    # Create a plist per UUID, each indicating a binary slice to remap paths.
+    # They all have the same contents, so only the first one is written out and
+    # the others are hard links to it.
+    first_plist = None
+    for uuid, _ in uuid_info_found:
+      remap_plist = self._CreateUUIDPlist(dsym_bundle_path,
+                                          uuid,
+                                          plist_contents,
+                                          first_plist)
+      if not remap_plist:
+        return 405, []
+      first_plist = first_plist or remap_plist
+
+    return 0, uuid_info_found
 
   def _NormalizePath(self, path):
     """Returns paths with a common form, normalized with a trailing slash.
@@ -1741,43 +2165,59 @@ class BazelBuildBridge(object):
                   the paths to Xcode-visible sources used for the purposes
                   of Tulsi debugging as strings ($1).
     """
+    cached = self.target_source_maps.get(normalize)
+    if cached:
+      return cached
+
     # All paths route to the "workspace root" for sources visible from Xcode.
-    sm_destpath = self.workspace_root
     if normalize:
-      sm_destpath = self._NormalizePath(sm_destpath)
+      sm_destpath = self.normalized_workspace_root
+    else:
+      sm_destpath = self.workspace_root
 
     # Add a redirection for the Bazel execution root, the path where sources
     # are referenced by Bazel.
     sm_execroot = self.bazel_exec_root
     if normalize:
       sm_execroot = self._NormalizePath(sm_execroot)
-    return (sm_execroot, sm_destpath)
+    source_map = (sm_execroot, sm_destpath)
+    self.target_source_maps[normalize] = source_map
+    return source_map
 
   def _LinkTulsiWorkspace(self):
     """Links the Bazel Workspace to the Tulsi Workspace (`tulsi-workspace`)."""
-    tulsi_workspace = os.path.join(self.project_file_path,
-                                   '.tulsi',
-                                   'tulsi-workspace')
-    if os.path.islink(tulsi_workspace):
-      os.unlink(tulsi_workspace)
-    os.symlink(self.bazel_exec_root, tulsi_workspace)
-    if not os.path.exists(tulsi_workspace):
+    tulsi_workspace = os.path.join(self.tulsi_dir, 'tulsi-workspace')
+    # Create the new link next to the old one and rename it into place, which
+    # atomically replaces the old link so that it never goes missing.
+    tmp_link = tulsi_workspace + '.tmp'
+    try:
+      if os.path.islink(tmp_link):
+        os.unlink(tmp_link)
+      os.symlink(self.bazel_exec_root, tmp_link)
+      os.rename(tmp_link, tulsi_workspace)
+    except OSError as e:
       _PrintXcodeError(
-          'Linking Tulsi Workspace to %s failed.' % tulsi_workspace)
+          'Linking Tulsi Workspace to %s failed. %s' % (tulsi_workspace, e))
       return -1
+    return 0
 
-  @staticmethod
-  def _SplitPathComponents(path):
-    """Splits the given path into an array of all of its components."""
-    components = path.split(os.sep)
-    # Patch up the first component if path started with an os.sep
-    if not components[0]:
-      components[0] = os.sep
-    return components
-
-  def _RunSubprocess(self, cmd):
-    """Runs the given command as a subprocess, returning (exit_code, output)."""
+  def _RunSubprocess(self, cmd, capture=True):
+    """Runs the given command as a subprocess, returning (exit_code, output).
+
+    Args:
+      cmd: The command to run, as a list of arguments.
+      capture: Whether the combined stdout and stderr of the command should be
+               returned. If False, the output is discarded without buffering
+               it and '' is returned in its place.
+
+    Returns:
+      (int, str): The exit code of the command and its output.
+    """
     self._PrintVerbose('%r' % cmd, 1)
+    if not capture:
+      with open(os.devnull, 'wb') as devnull:
+        returncode = subprocess.call(cmd, stdout=devnull, stderr=devnull)
+      return (returncode, '')
     process = subprocess.Popen(cmd,
                                stdout=subprocess.PIPE,
                                stderr=subprocess.STDOUT)
@@ -1794,7 +2234,11 @@ def main(argv):
   if build_settings is None:
     _Fatal('Unable to resolve build settings. Please report a Tulsi bug.')
     return 1
-  return BazelBuildBridge(build_settings).Run(argv)
+  bazel_build_bridge = BazelBuildBridge(build_settings)
+  try:
+    return bazel_build_bridge.Run(argv)
+  finally:
+    bazel_build_bridge.JoinBackgroundTasks()
 
 
 if __name__ == '__main__':
@@ -1806,7 +2250,6 @@ if __name__ == '__main__':
   logger_warning = tulsi_logging.validity_check()
   if logger_warning:
     _PrintXcodeWarning(logger_warning)
-  _timer = Timer('Everything', 'complete_build').Start()
-  _exit_code = main(sys.argv)
-  _timer.End()
+  with Timer('Everything', 'complete_build'):
+    _exit_code = main(sys.argv)
   sys.exit(_exit_code)
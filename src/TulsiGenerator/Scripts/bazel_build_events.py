@@ -36,21 +36,32 @@ class _FileLineReader(object):
       A FileLineReader instance.
     """
     self._file_obj = file_obj
-    self._buffer = []
+    self._buffer = bytearray()
 
   def check_for_changes(self):
     """Checks the file for any changes, returning the line read if any."""
     line = self._file_obj.readline()
-    self._buffer.append(line)
 
     # Only parse complete lines.
-    if not line.endswith('\n'):
+    if not line.endswith(b'\n'):
+      self._buffer.extend(line)
       return None
-    full_line = ''.join(self._buffer)
+    if not self._buffer:
+      return line
+    self._buffer.extend(line)
+    full_line = bytes(self._buffer)
     del self._buffer[:]
     return full_line
 
 
+def _decode_json_line(line):
+  """Decodes a line of UTF-8 encoded JSON, ignoring invalid byte sequences."""
+  try:
+    return json.loads(line)
+  except UnicodeDecodeError:
+    return json.loads(line.decode('utf-8', 'ignore'))
+
+
 class BazelBuildEvent(object):
   """Represents a Bazel Build Event.
 
@@ -98,7 +109,7 @@ class BazelBuildEventsWatcher(object):
     """Creates a new BazelBuildEventsWatcher object.
 
     Args:
-      json_file: The JSON file object to watch.
+      json_file: The JSON file object to watch, opened in binary mode.
       warning_handler: Handler function for warnings accepting a single string.
 
     Returns:
@@ -123,8 +134,8 @@ class BazelBuildEventsWatcher(object):
       if not line:
         break
       try:
-        build_event_dict = json.loads(line)
-      except (UnicodeDecodeError, ValueError) as e:
+        build_event_dict = _decode_json_line(line)
+      except ValueError as e:
         handler = self.warning_handler
         if handler:
           handler('Could not decode BEP event "%s"\n' % line)
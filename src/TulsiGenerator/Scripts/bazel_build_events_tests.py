@@ -113,5 +113,18 @@ class TestBazelBuildEventsWatcher(unittest.TestCase):
     self.assertEqual(build_event.stderr, 'World')
     self.assertEqual(build_event.files, ['/dir/file.txt'])
 
+  def testWatcherDecodesUTF8(self):
+    test_file = StringIO.StringIO()
+    watcher = bazel_build_events.BazelBuildEventsWatcher(test_file)
+    event_dict = {'progress': {'stderr': u'Hello \u2603'}}
+    test_file.write(json.dumps(event_dict, ensure_ascii=False).encode('utf-8'))
+    test_file.write('\n')
+    test_file.write('{"progress": {"stderr": "Bad \xff byte"}}\n')
+    test_file.seek(0)
+    new_events = watcher.check_for_new_events()
+    self.assertEqual(len(new_events), 2)
+    self.assertEqual(new_events[0].stderr, u'Hello \u2603')
+    self.assertEqual(new_events[1].stderr, u'Bad  byte')
+
 if __name__ == '__main__':
   unittest.main()
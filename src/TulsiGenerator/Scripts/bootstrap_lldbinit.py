@@ -16,17 +16,26 @@
 """Bootstraps the presence and setup of ~/.lldbinit-tulsiproj."""
 
 import os
-import shutil
-import StringIO
 import sys
 
 
-TULSI_LLDBINIT_FILE = os.path.expanduser('~/.lldbinit-tulsiproj')
+_HOME = os.path.expanduser('~')
+
+TULSI_LLDBINIT_FILE = os.path.join(_HOME, '.lldbinit-tulsiproj')
+
+# lldbinit files that Xcode reads on startup, in order of preference. Only the
+# first one that exists is read.
+XCODE_LLDBINIT_FILES = (os.path.join(_HOME, '.lldbinit-Xcode'),
+                        os.path.join(_HOME, '.lldbinit'))
 
 CHANGE_NEEDED = 0
 NO_CHANGE = 1
 NOT_FOUND = 2
 
+# Markers delimiting the block that references TULSI_LLDBINIT_FILE.
+_TULSI_LLDBINIT_BLOCK_START = '# <TULSI> LLDB bridge [:'
+_TULSI_LLDBINIT_BLOCK_END = '# ]: <TULSI> LLDB bridge'
+
 
 class BootstrapLLDBInit(object):
   """Bootstrap Xcode's preferred lldbinit for Bazel debugging."""
@@ -42,66 +51,44 @@ class BootstrapLLDBInit(object):
         the source string.
 
     Returns:
-      (int, [string]): A tuple featuring the status code along with the list
-                       of strings representing content to write to lldbinit
-                       that does not account for the Tulsi-generated strings.
-                       Status code will be 0 if Tulsi-generated strings are
-                       not all there. Status code will be 1 if we intend to
-                       write Tulsi strings and all strings were accounted for.
-                       Alternatively, if we intend to remove the Tulsi strings,
-                       the status code will be 1 if none of the strings were
-                       found. Status code will be 2 if the lldbinit file could
-                       not be found.
+      (int, string): A tuple featuring the status code along with the content
+                     to write to lldbinit that does not account for the
+                     Tulsi-generated strings. Status code will be 0 if
+                     Tulsi-generated strings are not all there. Status code
+                     will be 1 if we intend to write Tulsi strings and all
+                     strings were accounted for. Alternatively, if we intend to
+                     remove the Tulsi strings, the status code will be 1 if
+                     none of the strings were found. Status code will be 2 if
+                     the lldbinit file could not be found.
     """
     if not os.path.isfile(lldbinit_path):
-      return (NOT_FOUND, [])
-    content = []
+      return (NOT_FOUND, '')
     with open(lldbinit_path) as f:
-      ignoring = False
-
-      # Split on the newline. This works as long as the last string isn't
-      # suffixed with \n.
-      source_lines = source_string.split('\n')
-
-      source_idx = 0
-
-      # If the last line was suffixed with \n, last elements would be length
-      # minus 2, accounting for the extra \n.
-      source_last = len(source_lines) - 1
-
-      for line in f:
-
-        # For each line found matching source_string, increment the iterator
-        # and do not append that line to the list.
-        if source_idx <= source_last and source_lines[source_idx] in line:
-
-          # If we intend to write the source string and all lines were found,
-          # return an error code with empty content.
-          if add_source_string and source_idx == source_last:
-            return (NO_CHANGE, [])
-
-          # Increment for each matching line found.
-          source_idx += 1
-          ignoring = True
-
-        if ignoring:
-
-          # If the last line was found...
-          if source_lines[source_last] in line:
-            # Stop ignoring lines and continue appending to content.
-            ignoring = False
-          continue
-
-        # If the line could not be found within source_string, append to the
-        # content array.
-        content.append(line)
-
-    # If we intend to remove the source string and none of the lines to remove
-    # were found, return an error code with empty content.
-    if not add_source_string and source_idx == 0:
-      return (NO_CHANGE, [])
-
-    return (CHANGE_NEEDED, content)
+      content = f.read()
+
+    # If we intend to write the source string and it is already present, return
+    # an error code with empty content.
+    if add_source_string and source_string in content:
+      return (NO_CHANGE, '')
+
+    start = content.find(_TULSI_LLDBINIT_BLOCK_START)
+    if start < 0:
+      # If we intend to remove the source string and it was not found, return an
+      # error code with empty content.
+      if not add_source_string:
+        return (NO_CHANGE, '')
+      return (CHANGE_NEEDED, content)
+
+    # Cut the whole Tulsi block, from the start of the line holding its first
+    # marker through the end of the line holding its last marker. A malformed
+    # block without an end marker extends to the end of the file.
+    start = content.rfind('\n', 0, start) + 1
+    end = content.find(_TULSI_LLDBINIT_BLOCK_END, start)
+    if end >= 0:
+      end = content.find('\n', end) + 1
+    if end <= 0:
+      end = len(content)
+    return (CHANGE_NEEDED, content[:start] + content[end:])
 
   def _LinkTulsiLLDBInit(self, add_source_string):
     """Adds or removes a reference to ~/.lldbinit-tulsiproj to the primary lldbinit file.
@@ -120,63 +107,49 @@ class BootstrapLLDBInit(object):
 
     # ~/.lldbinit-Xcode is the only lldbinit file that Xcode will read if it is
     # present, therefore it has priority.
-    lldbinit_path = os.path.expanduser('~/.lldbinit-Xcode')
+    lldbinit_path = XCODE_LLDBINIT_FILES[0]
     if not os.path.isfile(lldbinit_path):
       # If ~/.lldbinit-Xcode does not exist, write the reference to
       # ~/.lldbinit-tulsiproj to ~/.lldbinit, the second lldbinit file that
       # Xcode will attempt to read if ~/.lldbinit-Xcode isn't present.
-      lldbinit_path = os.path.expanduser('~/.lldbinit')
+      lldbinit_path = XCODE_LLDBINIT_FILES[1]
 
     # String that we plan to inject or remove from this lldbinit.
-    source_string = ('# <TULSI> LLDB bridge [:\n'
+    source_string = (_TULSI_LLDBINIT_BLOCK_START + '\n'
                      '# This was autogenerated by Tulsi in order to modify '
                      'LLDB source-maps at build time.\n'
                      'command source %s\n' % TULSI_LLDBINIT_FILE +
-                     '# ]: <TULSI> LLDB bridge')
+                     _TULSI_LLDBINIT_BLOCK_END)
 
     # Retrieve the contents of lldbinit if applicable along with a return code.
     return_code, content = self._ExtractLLDBInitContent(lldbinit_path,
                                                         source_string,
                                                         add_source_string)
 
-    out = StringIO.StringIO()
-
     if add_source_string:
-      if return_code == CHANGE_NEEDED:
-        # Print the existing contents of this ~/.lldbinit without any malformed
-        # tulsi lldbinit block, and add the correct tulsi lldbinit block to the
-        # end of it.
-        for line in content:
-          out.write(line)
-      elif return_code == NO_CHANGE:
+      if return_code == NO_CHANGE:
         # If we should ignore the contents of this lldbinit, and it has the
         # association with ~/.lldbinit-tulsiproj that we want, do not modify it.
         return
 
-      # Add a newline after the source_string for protection from other elements
-      # within the lldbinit file.
-      out.write(source_string + '\n')
+      # Keep the existing contents of this ~/.lldbinit without any malformed
+      # tulsi lldbinit block, and add the correct tulsi lldbinit block to the
+      # end of it. Add a newline after the source_string for protection from
+      # other elements within the lldbinit file.
+      content += source_string + '\n'
     else:
       if return_code != CHANGE_NEEDED:
         # The source string was not found in the lldbinit so do not modify it.
         return
 
-      # Print the existing contents of this ~/.lldbinit without the tulsi
-      # lldbinit block.
-      for line in content:
-        out.write(line)
-
-      out.seek(0, os.SEEK_END)
-      if out.tell() == 0:
+      if not content:
         # The file did not contain any content other than the source string so
         # remove the file altogether.
         os.remove(lldbinit_path)
         return
 
     with open(lldbinit_path, 'w') as outfile:
-      out.seek(0)
-      # Negative length to make copyfileobj write the whole file at once.
-      shutil.copyfileobj(out, outfile, -1)
+      outfile.write(content)
 
   def __init__(self, do_inject_link=True):
     self._LinkTulsiLLDBInit(do_inject_link)
@@ -57,6 +57,13 @@ class Installer(object):
       except (ValueError, IOError) as e:
         print('Failed to load output data file "%s". %s' % (file_path, e))
 
+  def InstallForOutputsData(self, outputs_data):
+    """Creates tulsi includes and symlinks sources from parsed tulsiouts."""
+    self.PrepareTulsiIncludes()
+
+    for output_data in outputs_data:
+      self.InstallForData(output_data)
+
   def InstallForData(self, output_data):
     """Symlinks generated sources present in the output_data."""
     bazel_exec_root = self.bazel_exec_root
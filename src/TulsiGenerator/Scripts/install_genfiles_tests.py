@@ -51,5 +51,17 @@ class TestInstallForData(unittest.TestCase):
     self.assertTrue(os.path.lexists(
         os.path.join(tmpdir, 'bazel-tulsi-includes/x/x/install_genfiles.py')))
 
+
+class TestInstallForOutputsData(unittest.TestCase):
+
+  def testInstallsAllOutputsData(self):
+    tmpdir = os.environ['TEST_TMPDIR']
+    installer = install_genfiles.Installer('.', output_root=tmpdir)
+    installer.InstallForOutputsData([DOES_NOT_EXIST_DATA, DOES_EXIST_DATA])
+    self.assertFalse(os.path.lexists(
+        os.path.join(tmpdir, 'bazel-tulsi-includes/x/x/exist.txt')))
+    self.assertTrue(os.path.lexists(
+        os.path.join(tmpdir, 'bazel-tulsi-includes/x/x/install_genfiles.py')))
+
 if __name__ == '__main__':
   unittest.main()
@@ -38,6 +38,17 @@ class UpdateSymbolCache(object):
     """
     con = self.cache_schema.connection
     cur = con.cursor()
+    # Incremental builds typically report the same UUID for a dSYM path and
+    # arch pair every time; skip the write and commit if nothing changed.
+    try:
+      cur.execute('SELECT uuid FROM symbol_cache '
+                  'WHERE dsym_path = "%s" AND architecture = "%s";'
+                  % (dsym_path, arch))
+      row = cur.fetchone()
+    except sqlite3.Error as e:
+      return e.message
+    if row and row[0] == uuid:
+      return None
     # Relies on the UNIQUE constraint between dsym_path + architecture to
     # update the UUID if dsym_path and arch match an existing pair, or
     # create a new row if this combination of dsym_path and arch is unique.
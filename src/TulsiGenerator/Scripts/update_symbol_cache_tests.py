@@ -86,6 +86,29 @@ class TestUpdatingSymbolCache(unittest.TestCase):
     self.assertEqual(rows_inserted[0][1], dsym_path)
     self.assertEqual(rows_inserted[0][2], arch)
 
+  def testUpdatingWithUnchangedUUID(self):
+    uuid = 'A1F3C0E2-4C1B-3D0E-9B7A-2E6F7D8C9B0A'
+    dsym_path = '/usr/lib'  # Using a directory in place of dSYM.
+    arch = 'arm64'
+
+    update_symbol_cache = UpdateSymbolCache(SHARED_MEMORY_DB)
+    err_msg = update_symbol_cache.UpdateUUID(uuid, dsym_path, arch)
+    self.assertFalse(err_msg)
+
+    connection = update_symbol_cache.cache_schema.connection
+    changes = connection.total_changes
+    err_msg = update_symbol_cache.UpdateUUID(uuid, dsym_path, arch)
+    self.assertFalse(err_msg)
+    self.assertEqual(connection.total_changes, changes)
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT uuid, dsym_path, architecture FROM symbol_cache '
+                   'WHERE dsym_path = "%s";' % dsym_path)
+    rows_inserted = cursor.fetchall()
+    self.assertEqual(len(rows_inserted), 1)
+    self.assertEqual(rows_inserted[0][0], uuid)
+    self.assertEqual(rows_inserted[0][2], arch)
+
 
 if __name__ == '__main__':
   unittest.main()